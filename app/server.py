@@ -59,9 +59,14 @@ requests more quickly.
 
 """
 
+import hashlib
 import json
 import os
+import threading
+import time
+import urllib
 
+import cachetools
 import config
 import ee
 import jinja2
@@ -80,14 +85,14 @@ class MainHandler(webapp2.RequestHandler):
 
   def get(self, path=''):
     """Returns the main web page, populated with EE map and polygon info."""
-    mapid = GetTrendyMapId()
+    InitializeEarthEngine()
+    mapid = GetCachedTrendyMapId()
     template_values = {
         'eeMapId': mapid['mapid'],
         'eeToken': mapid['token'],
-        'serializedPolygonIds': json.dumps(POLYGON_IDS)
+        'serializedPolygonIds': SERIALIZED_POLYGON_IDS
     }
-    template = JINJA2_ENVIRONMENT.get_template('index.html')
-    self.response.out.write(template.render(template_values))
+    self.response.out.write(INDEX_TEMPLATE.render(template_values))
 
 
 class DetailsHandler(webapp2.RequestHandler):
@@ -96,19 +101,39 @@ class DetailsHandler(webapp2.RequestHandler):
   def get(self):
     """Returns details about a polygon."""
     polygon_id = self.request.get('polygon_id')
-    if polygon_id in POLYGON_IDS:
-      content = GetPolygonTimeSeries(polygon_id)
+    etag = None
+    if polygon_id in POLYGON_IDS_SET:
+      content, etag = GetPolygonTimeSeries(polygon_id)
     else:
-      content = json.dumps({'error': 'Unrecognized polygon ID: ' + polygon_id})
+      content = ToJson({'error': 'Unrecognized polygon ID: ' + polygon_id})
     self.response.headers['Content-Type'] = 'application/json'
+    if etag is not None:
+      self.response.headers['ETag'] = etag
+      # If the browser already has these details, don't send them again.
+      if self.request.headers.get('If-None-Match') == etag:
+        self.response.set_status(304)
+        return
     self.response.out.write(content)
 
 
+class WarmupHandler(webapp2.RequestHandler):
+  """A servlet to handle App Engine's warmup requests for new instances."""
+
+  def get(self):
+    """Initializes EE and fills this instance's caches before users arrive."""
+    InitializeEarthEngine()
+    GetCachedTrendyMapId()
+    # The polygon files can change, so only warm up with one that exists.
+    if WARMUP_POLYGON_ID in POLYGON_IDS_SET:
+      GetPolygonTimeSeries(WARMUP_POLYGON_ID)
+
+
 # Define webapp2 routing from URL paths to web request handlers. See:
 # http://webapp-improved.appspot.com/tutorials/quickstart.html
 app = webapp2.WSGIApplication([
     ('/details', DetailsHandler),
     ('/', MainHandler),
+    ('/_ah/warmup', WarmupHandler),
 ])
 
 
@@ -129,57 +154,41 @@ app = webapp2.WSGIApplication([
 # Builds Interactive Terms
 def applytransforms(mcd43Image):
     # Select the algorithm bands and rescale to Qld RSC values
-    useBands = mcd43Image.select(["Nadir_Reflectance_Band4", "Nadir_Reflectance_Band1", "Nadir_Reflectance_Band2", "Nadir_Reflectance_Band5","Nadir_Reflectance_Band6","Nadir_Reflectance_Band7"],["band2","band3","band4","band5","band6","band7"]).add(1).divide(10000)
+    useBands = mcd43Image.select(MODIS_BANDS, REFLECTANCE_BANDS).add(1).divide(10000)
     logBands = useBands.log();
-    # Combine the bands into a new image
-    # Note that this line is missing logBands.expression("b('band4') * b('band7')"),
-    return ee.Image.cat(
-      useBands.expression("b('band2') * b('band3')"),
-      useBands.expression("b('band2') * b('band4')"),
-      useBands.expression("b('band2') * b('band5')"),
-      useBands.expression("b('band2') * b('band6')"),
-      useBands.expression("b('band2') * b('band7')"),
-      useBands.expression("b('band2') * logs", {'logs': logBands}),
-      useBands.expression("b('band3') * b('band4')"),
-      useBands.expression("b('band3') * b('band5')"),
-      useBands.expression("b('band3') * b('band6')"),
-      useBands.expression("b('band3') * b('band7')"),
-      useBands.expression("b('band3') * logs", {'logs': logBands}),
-      useBands.expression("b('band4') * b('band5')"),
-      useBands.expression("b('band4') * b('band6')"),
-      useBands.expression("b('band4') * b('band7')"),
-      useBands.expression("b('band4') * logs", {'logs': logBands}),
-      useBands.expression("b('band5') * b('band6')"),
-      useBands.expression("b('band5') * b('band7')"),
-      useBands.expression("b('band5') * logs", {'logs': logBands}),
-      useBands.expression("b('band6') * b('band7')"),
-      useBands.expression("b('band6') * logs", {'logs': logBands}),
-      useBands.expression("b('band7') * logs", {'logs': logBands}),
-      logBands.expression("b('band2') * b('band3')"),
-      logBands.expression("b('band2') * b('band4')"),
-      logBands.expression("b('band2') * b('band5')"),
-      logBands.expression("b('band2') * b('band6')"),
-      logBands.expression("b('band2') * b('band7')"),
-      logBands.expression("b('band3') * b('band4')"),
-      logBands.expression("b('band3') * b('band5')"),
-      logBands.expression("b('band3') * b('band6')"),
-      logBands.expression("b('band3') * b('band7')"),
-      logBands.expression("b('band4') * b('band5')"),
-      logBands.expression("b('band4') * b('band6')"),
-      logBands.expression("b('band5') * b('band6')"),
-      logBands.expression("b('band5') * b('band7')"),
-      logBands.expression("b('band6') * b('band7')"),
-      useBands,
-      logBands,
-      ee.Image(0.25))
-      
-  
- 
+    # Form every interactive term with one band-wise multiplication of the
+    # reflectance and log bands, selected in pairs, rather than one expression
+    # per term. See InteractiveTermBands for the order of the terms.
+    allBands = useBands.addBands(logBands.select(REFLECTANCE_BANDS, LOG_BANDS))
+    terms = allBands.select(TERM_LEFT_BANDS, TERM_NAMES).multiply(
+        allBands.select(TERM_RIGHT_BANDS, TERM_NAMES))
+    # Combine the bands into a new image. allBands already holds the
+    # reflectance bands followed by the log bands, in that order.
+    return ee.Image.cat(terms, allBands, ee.Image(0.25))
+
+
+def InteractiveTermBands():
+  """Returns the left and right band names of each interactive term.
+
+  The order must match the endmembers: each reflectance band times every
+  later reflectance band and then every log band, followed by each log band
+  times every later log band. Note that log band4 * log band7 is missing.
+  """
+  pairs = []
+  for i, band in enumerate(REFLECTANCE_BANDS):
+    pairs += [(band, other) for other in REFLECTANCE_BANDS[i + 1:]]
+    pairs += [(band, log) for log in LOG_BANDS]
+  for i, log in enumerate(LOG_BANDS):
+    pairs += [(log, other) for other in LOG_BANDS[i + 1:]
+              if (log, other) != ('log4', 'log7')]
+  return [left for left, _ in pairs], [right for _, right in pairs]
+
+
 def GetTrendyMapId():
   # Import MODIS Imagery and sort from most recent
   mcd43a4 = ee.ImageCollection('MODIS/MCD43A4').sort('system:time_start', False )
   # Apply the variable transforms and unmix
-  unmixedCollection = mcd43a4.map(lambda img:applytransforms(img).unmix([end_bare,end_gren,end_dead]).select(["band_0","band_1","band_2"]))
+  unmixedCollection = mcd43a4.map(lambda img:applytransforms(img).unmix(ENDMEMBERS).select(["band_0","band_1","band_2"]))
 
   
   # Get the latest image
@@ -214,61 +223,218 @@ def GetTrendyMapId():
 #   })
 
 
+def GetCachedTrendyMapId():
+  """Returns this instance's MapID for the map, recomputing it when stale.
+
+  The lock is only held to check and swap the MapID, never during the EE
+  request. While one request refreshes a stale MapID, the others keep serving
+  the old one. Until there is a MapID at all, each request computes its own.
+  """
+  with TRENDY_MAPID_LOCK:
+    mapid = TRENDY_MAPID['mapid']
+    if time.time() - TRENDY_MAPID['time'] <= MAPID_EXPIRATION:
+      return mapid
+    if mapid is not None and TRENDY_MAPID['refreshing']:
+      return mapid
+    TRENDY_MAPID['refreshing'] = True
+
+  new_mapid = None
+  try:
+    new_mapid = GetTrendyMapId()
+  except ee.EEException:
+    # Keep serving the old MapID, if there is one; a later request retries.
+    if mapid is None:
+      raise
+  finally:
+    with TRENDY_MAPID_LOCK:
+      TRENDY_MAPID['refreshing'] = False
+      if new_mapid is not None:
+        TRENDY_MAPID['mapid'] = new_mapid
+        TRENDY_MAPID['time'] = time.time()
+  return new_mapid if new_mapid is not None else mapid
+
+
 def GetPolygonTimeSeries(polygon_id):
-  """Returns details about the polygon with the passed-in ID."""
-  details = memcache.get(polygon_id)
+  """Returns details about the polygon with the passed-in ID, and their ETag.
+
+  The ETag is None if the details couldn't be computed.
+  """
+  # Check this instance's own cache first, which avoids a memcache RPC.
+  with POLYGON_DETAILS_LOCK:
+    cached = POLYGON_DETAILS_CACHE.get(polygon_id)
+  if cached is not None:
+    return cached
+
+  details_json = memcache.get(polygon_id)
 
   # If we've cached details for this polygon, return them.
-  if details is not None:
-    return details
+  if details_json is not None:
+    return CacheDetailsLocally(polygon_id, details_json)
 
-  details = {'wikiUrl': WIKI_URL + polygon_id.replace('-', '%20')}
+  details = {'wikiUrl': WIKI_URLS[polygon_id]}
 
   try:
+    # Only a cache miss needs EE, so only initialize it here.
+    InitializeEarthEngine()
     details['timeSeries'] = ComputePolygonTimeSeries(polygon_id)
-    # Store the results in memcache.
-    memcache.add(polygon_id, json.dumps(details), MEMCACHE_EXPIRATION)
+    # Store the results in memcache and in this instance's cache. Use set()
+    # rather than add() so a concurrent request computing the same details
+    # doesn't make this store fail.
+    details_json = ToJson(details)
+    memcache.set(polygon_id, details_json, MEMCACHE_EXPIRATION)
+    return CacheDetailsLocally(polygon_id, details_json)
   except ee.EEException as e:
     # Handle exceptions from the EE client library.
     details['error'] = str(e)
 
   # Send the results to the browser.
-  return json.dumps(details)
+  return ToJson(details), None
+
+
+def CacheDetailsLocally(polygon_id, details_json):
+  """Stores serialized details and their ETag in this instance's cache."""
+  etag = '"%s"' % hashlib.sha1(details_json).hexdigest()
+  with POLYGON_DETAILS_LOCK:
+    POLYGON_DETAILS_CACHE[polygon_id] = (details_json, etag)
+  return details_json, etag
+
+
+def PrimePolygonDetailsCache():
+  """Fills this instance's cache with the polygon details already in memcache."""
+  cached_details = memcache.get_multi(POLYGON_IDS)
+  for polygon_id, details_json in cached_details.items():
+    CacheDetailsLocally(polygon_id, details_json)
 
 
 def ComputePolygonTimeSeries(polygon_id):
   """Returns a series of brightness over time for the polygon."""
+  geometry = POLYGON_GEOMETRIES[polygon_id]
+
+  # Skip images that don't touch the polygon. Its bounding rectangle, computed
+  # from the polygon's coordinates at startup, is much cheaper for EE to filter
+  # with than the polygon itself.
   collection = ee.ImageCollection(IMAGE_COLLECTION_ID)
-  collection = collection.select('stable_lights').sort('system:time_start')
-  feature = GetFeature(polygon_id)
-
-  # Compute the mean brightness in the region in each image.
-  def ComputeMean(img):
-    reduction = img.reduceRegion(
-        ee.Reducer.mean(), feature.geometry(), REDUCTION_SCALE_METERS)
-    return ee.Feature(None, {
-        'stable_lights': reduction.get('stable_lights'),
-        'system:time_start': img.get('system:time_start')
-    })
-  chart_data = collection.map(ComputeMean).getInfo()
-
-  # Extract the results as a list of lists.
-  def ExtractMean(feature):
-    return [
-        feature['properties']['system:time_start'],
-        feature['properties']['stable_lights']
-    ]
-  return map(ExtractMean, chart_data['features'])
-
-
-def GetFeature(polygon_id):
-  """Returns an ee.Feature for the polygon with the given ID."""
+  collection = (collection.select('stable_lights')
+                .filterBounds(POLYGON_BOUNDS[polygon_id])
+                .sort('system:time_start'))
+
+  # Compute the mean brightness in the region in each image with a single
+  # reduction over all the images stacked into one multiband image.
+  stacked = collection.toBands()
+  means = stacked.reduceRegion(
+      ee.Reducer.mean(), geometry, REDUCTION_SCALE_METERS)
+
+  # Fetch the image dates and the means, in the same order, in one request.
+  chart_data = ee.Dictionary({
+      'times': collection.aggregate_array('system:time_start'),
+      'means': means.values(stacked.bandNames())
+  }).getInfo()
+
+  # Pair up the results as a list of [time, mean] points for the chart.
+  return [[t, mean]
+          for t, mean in zip(chart_data['times'], chart_data['means'])]
+
+
+def ToJson(value):
+  """Serializes a value as compact JSON, without whitespace between tokens."""
+  return json.dumps(value, separators=(',', ':'))
+
+
+def InitializeEarthEngine():
+  """Initializes the EE API and the polygons built with it, once per instance.
+
+  This is called by the page and warmup handlers, and before computing
+  polygon details that aren't cached, so the work happens on the instance's
+  warmup request or, if a user request arrives first, on the first request
+  that needs EE. Concurrent requests wait for it to finish.
+  """
+  if EE_INITIALIZED.is_set():
+    return
+  with EE_INITIALIZATION_LOCK:
+    if EE_INITIALIZED.is_set():
+      return
+    ee.Initialize(EE_CREDENTIALS)
+
+    # Read every polygon and build its geometry and bounding box once, so that
+    # requests for polygon details don't touch the file system or rebuild
+    # them. This must happen after ee.Initialize().
+    for polygon_id in POLYGON_IDS:
+      geometry, bounds = LoadGeometry(polygon_id)
+      POLYGON_GEOMETRIES[polygon_id] = geometry
+      POLYGON_BOUNDS[polygon_id] = bounds
+
+    EE_INITIALIZED.set()
+
+
+def LoadGeometry(polygon_id):
+  """Reads the polygon with the given ID from disk into an ee.Geometry.
+
+  Returns:
+    The polygon's ee.Geometry and an ee.Geometry.Rectangle bounding it. If the
+    geometry has no coordinates to bound, e.g. a GeometryCollection, it's
+    returned in place of the rectangle.
+  """
   # Note: The polygon IDs are read from the filesystem in the initialization
   # section below. "sample-id" corresponds to "static/polygons/sample-id.json".
   path = POLYGON_PATH + polygon_id + '.json'
   path = os.path.join(os.path.split(__file__)[0], path)
   with open(path) as f:
-    return ee.Feature(json.load(f))
+    feature = json.load(f)
+  # Send EE only as much precision as the reduction can use. Build the
+  # geometry directly, rather than as a feature's geometry(), so requests
+  # carry the geometry itself and not a server-side call to extract it.
+  geojson = RoundGeometry(feature['geometry'])
+  geometry = ee.Geometry(geojson)
+  if 'coordinates' not in geojson:
+    return geometry, geometry
+  points = list(GeometryPoints(geojson['coordinates']))
+  lngs = [point[0] for point in points]
+  lats = [point[1] for point in points]
+  bounds = ee.Geometry.Rectangle([min(lngs), min(lats), max(lngs), max(lats)])
+  return geometry, bounds
+
+
+def GeometryPoints(coordinates):
+  """Yields every [lng, lat] point in nested GeoJSON coordinates."""
+  if isinstance(coordinates[0], (int, long, float)):
+    yield coordinates
+  else:
+    for nested in coordinates:
+      for point in GeometryPoints(nested):
+        yield point
+
+
+def RoundGeometry(geometry):
+  """Returns a GeoJSON Polygon or MultiPolygon with its coordinates rounded.
+
+  Geometries of any other type are returned unchanged.
+  """
+  if geometry['type'] == 'Polygon':
+    coordinates = [RoundRing(ring) for ring in geometry['coordinates']]
+  elif geometry['type'] == 'MultiPolygon':
+    coordinates = [[RoundRing(ring) for ring in polygon]
+                   for polygon in geometry['coordinates']]
+  else:
+    return geometry
+  return {'type': geometry['type'], 'coordinates': coordinates}
+
+
+def RoundRing(ring):
+  """Rounds a ring's [lng, lat] points to COORDINATE_DECIMALS places.
+
+  Points that round to the same place as the previous point are dropped. If
+  that would leave fewer than the four points a closed ring needs, the ring is
+  returned unchanged.
+  """
+  rounded = []
+  for point in ring:
+    point = [round(point[0], COORDINATE_DECIMALS),
+             round(point[1], COORDINATE_DECIMALS)]
+    if not rounded or point != rounded[-1]:
+      rounded.append(point)
+  if len(rounded) < 4:
+    return ring
+  return rounded
 
 
 ###############################################################################
@@ -281,6 +447,17 @@ def GetFeature(polygon_id):
 # https://cloud.google.com/appengine/docs/python/memcache/
 MEMCACHE_EXPIRATION = 60 * 60 * 24
 
+# Each instance also keeps the serialized details of the most recently used
+# polygons, along with their ETags, in memory so repeat requests don't need a
+# memcache RPC. Entries expire MEMCACHE_EXPIRATION after this instance stores
+# them, which can be up to that much later than the memcache copy they came
+# from expires. That's harmless, as the details of a polygon don't change.
+LOCAL_CACHE_SIZE = 256
+
+# The map is built from fixed endmembers and only changes as new MODIS imagery
+# lands, so each instance reuses its MapID for this long before recomputing it.
+MAPID_EXPIRATION = 60 * 60 * 6
+
 # The ImageCollection of the night-time lights dataset. See:
 # https://earthengine.google.org/#detail/NOAA%2FDMSP-OLS%2FNIGHTTIME_LIGHTS
 IMAGE_COLLECTION_ID = 'NOAA/DMSP-OLS/NIGHTTIME_LIGHTS'
@@ -291,9 +468,34 @@ POLYGON_PATH = 'static/polygons/'
 # The scale at which to reduce the polygons for the brightness time series.
 REDUCTION_SCALE_METERS = 20000
 
+# The decimal places kept in polygon coordinates when they're loaded, i.e.
+# roughly 100 meters. Against the reduction scale that shift is negligible,
+# whereas the 15 digits in the GeoJSON files inflate every request to EE.
+COORDINATE_DECIMALS = 3
+
+# The polygon whose details the warmup request computes, which also exercises
+# EE and memcache before the first user request. It's skipped if there is no
+# such polygon in static/polygons.
+WARMUP_POLYGON_ID = 'cerrado'
+
 # The Wikipedia URL prefix.
 WIKI_URL = 'http://en.wikipedia.org/wiki/'
 
+# The MODIS nadir reflectance bands used by the unmixing algorithm, the names
+# we give them and the names of their logs.
+MODIS_BANDS = [
+    'Nadir_Reflectance_Band4', 'Nadir_Reflectance_Band1',
+    'Nadir_Reflectance_Band2', 'Nadir_Reflectance_Band5',
+    'Nadir_Reflectance_Band6', 'Nadir_Reflectance_Band7']
+REFLECTANCE_BANDS = ['band2', 'band3', 'band4', 'band5', 'band6', 'band7']
+LOG_BANDS = ['log2', 'log3', 'log4', 'log5', 'log6', 'log7']
+
+# The bands multiplied together to form the interactive terms.
+TERM_LEFT_BANDS, TERM_RIGHT_BANDS = InteractiveTermBands()
+TERM_NAMES = [
+    left + '_' + right
+    for left, right in zip(TERM_LEFT_BANDS, TERM_RIGHT_BANDS)]
+
 
 
 # The Computed Endmembers
@@ -301,6 +503,9 @@ end_gren = [1.005625793718393224e-01,1.551381619046308113e-01,1.7929724456501161
 end_dead = [1.403263555258253970e-01,1.740844187309274482e-01,2.143776613700686950e-01,2.255999818141902202e-01,1.798486122880957883e-01,-5.094852507233389449e-01,-3.943909593752877307e-01,-3.271005665360072756e-01,-2.398086866572867459e-01,-2.170372016296666096e-01,-2.928484835748055848e-01,2.223184524922829086e-01,2.575036368121275121e-01,2.602762597110128695e-01,1.931895170928574212e-01,-4.820346521695523245e-01,-4.530716612145118116e-01,-3.526026536396565381e-01,-2.871558826934162978e-01,-2.870497154688096408e-01,-4.239204810729221284e-01,2.484599564187424114e-01,2.861343176253623999e-01,2.281157131292944340e-01,-2.709993459043758546e-01,-1.894416977490074316e-01,-4.114788420817422909e-01,-3.305979743382004843e-01,-2.178179862993682714e-01,-1.965442916311349320e-01,3.017090569531513111e-01,2.272570720493811425e-01,-1.660063649921281748e-01,-2.078556996556621961e-01,-4.160412189662338611e-01,-3.834399519794880473e-01,-3.046072308937279871e-01,-3.455947654101590438e-01,2.145926981364830732e-01,-1.759330674468164712e-01,-3.226994801832344106e-01,-3.554447967112595030e-01,-3.608555462410469872e-01,-3.653556708703253886e-01,-5.288465893028195808e-01,4.871148572665796872e-02,-1.921852869110349249e-01,-1.538614444787815561e-01,-2.039512166097949830e-01,-2.536145208364682380e-01,-4.333713519267466396e-01,-3.290012282223230278e-01,-2.558320130370689283e-01,9.049690808748311888e-02,2.429555937637380980e-01,2.593593821267571875e-01,3.562463529501999071e-01,3.307446747853375335e-01,1.799196323512836926e-01,-2.219392694669459487e-01,-3.576993626520880709e-01,1.845227897749066731e-02,-1.685206360984441709e-01,5.580296776298742517e-02,-4.145629855116072515e-01,4.135862588851957344e-01,4.966752147834995745e-01,5.020998941719694297e-01,5.618702492116707248e-01,5.940529187364148589e-01,4.158125345134185968e-01,-3.348135919834706042e-01,-4.891960223481561787e-01,-4.775706041789192779e-01,-4.063217768189702483e-01,-3.902195969483839844e-01,-5.475248235551297693e-01,0.25];
 end_bare = [1.557756133661153952e-01,1.802192110730069519e-01,2.214149969321710376e-01,2.378169515722290961e-01,2.167823936748812796e-01,-5.003139008582664360e-01,-3.858620353742320264e-01,-3.421557006601864126e-01,-2.561822930393134468e-01,-2.312584786760632782e-01,-2.534492576792338192e-01,2.320565217858724938e-01,2.736918995210841365e-01,2.878776178964150834e-01,2.581029762878466194e-01,-4.745006463997653023e-01,-4.212879123400909420e-01,-3.806564066788480361e-01,-3.037867195241924501e-01,-2.907748187098708748e-01,-3.319295543017048988e-01,2.418232712425302799e-01,2.813392488119939583e-01,2.763479007400641008e-01,-2.553586812522712912e-01,-2.148104467732427636e-01,-4.048503104537182762e-01,-3.368292685824204602e-01,-2.339882670913794593e-01,-1.459367612878482712e-01,2.994817350480266094e-01,2.997062696318842923e-01,-1.429721098700335868e-01,-2.050814814822079502e-01,-4.074130135695290811e-01,-3.783440378975941876e-01,-3.143608342429669023e-01,-2.387095954855755486e-01,3.026018626233351050e-01,-5.715470865161947911e-02,-1.997813302239145050e-01,-2.918934998203080999e-01,-3.067641746997048502e-01,-3.341194694934919718e-01,-3.347398350315027860e-01,-6.561644819416791174e-02,-2.114976663325430772e-01,-2.424937905246192793e-01,-2.467185800323841716e-01,-2.872824680797123054e-01,-3.344593134383595512e-01,-2.846135649729091277e-01,-2.302400388348356253e-01,6.664500979015522408e-02,2.303978017433380432e-01,2.281681038181598287e-01,2.555933168357400476e-01,2.387943621178491016e-01,7.191996580933962546e-02,-1.306805956480629749e-01,-3.364273224868226664e-01,1.181603266047939471e-01,-1.141124425180693319e-01,1.052852993043106866e-01,-4.738702699799992590e-01,4.284487379128869566e-01,5.211981857016393382e-01,4.921858390252278892e-01,5.432637332898500038e-01,5.550396166730965364e-01,5.269385781005170299e-01,-3.468334523171409667e-01,-5.224070998521183062e-01,-5.006934427040702351e-01,-4.453181641709889060e-01,-4.792341641719014556e-01,-4.946308016878979696e-01,0.25];
 
+# The endmembers, in the bare, green, dead order of the unmixed bands.
+ENDMEMBERS = [end_bare, end_gren, end_dead]
+
 ###############################################################################
 #                               Initialization.                               #
 ###############################################################################
@@ -309,19 +514,61 @@ end_bare = [1.557756133661153952e-01,1.802192110730069519e-01,2.2141499693217103
 # Use our App Engine service account's credentials.
 EE_CREDENTIALS = ee.ServiceAccountCredentials(config.EE_ACCOUNT, config.EE_PRIVATE_KEY_FILE)
 
+# The EE API is initialized lazily by InitializeEarthEngine(), which sets this
+# once done. See the WarmupHandler.
+EE_INITIALIZED = threading.Event()
+EE_INITIALIZATION_LOCK = threading.Lock()
+
+# The geometry and bounding box of each polygon, keyed by polygon ID. These
+# are filled in by InitializeEarthEngine().
+POLYGON_GEOMETRIES = {}
+POLYGON_BOUNDS = {}
+
+
+# The in-memory cache of (serialized details, ETag) pairs, shared by the
+# request threads of this instance. TTLCache isn't thread-safe, so guard it
+# with a lock.
+POLYGON_DETAILS_CACHE = cachetools.TTLCache(
+    maxsize=LOCAL_CACHE_SIZE, ttl=MEMCACHE_EXPIRATION)
+POLYGON_DETAILS_LOCK = threading.Lock()
+
+# This instance's MapID for the map, when it was computed and whether a request
+# is refreshing it, so that page loads don't each have to build the map and
+# request a MapID from EE.
+TRENDY_MAPID = {'mapid': None, 'time': 0, 'refreshing': False}
+TRENDY_MAPID_LOCK = threading.Lock()
 
 # Read the polygon IDs from the file system.
 POLYGON_IDS = [name.replace('.json', '') for name in os.listdir(POLYGON_PATH)]
 
+# The Wikipedia URL for each polygon, e.g. "sample-id" links to the article
+# titled "sample id".
+WIKI_URLS = {
+    polygon_id: WIKI_URL + urllib.quote(polygon_id.replace('-', ' '))
+    for polygon_id in POLYGON_IDS}
+
+# A set of the polygon IDs, for checking the IDs in requests.
+POLYGON_IDS_SET = frozenset(POLYGON_IDS)
+
+# The polygon IDs never change, so serialize them for the web page just once.
+SERIALIZED_POLYGON_IDS = ToJson(POLYGON_IDS)
+
 # Create the Jinja templating system we use to dynamically generate HTML. See:
 # http://jinja.pocoo.org/docs/dev/
+# Templates can't change while an instance is running, so don't have Jinja
+# check them for changes.
 JINJA2_ENVIRONMENT = jinja2.Environment(
     loader=jinja2.FileSystemLoader(os.path.dirname(__file__)),
     autoescape=True,
+    auto_reload=False,
     extensions=['jinja2.ext.autoescape'])
 
-# Initialize the EE API.
-ee.Initialize(EE_CREDENTIALS)
+# Load the main web page template once rather than looking it up per request.
+INDEX_TEMPLATE = JINJA2_ENVIRONMENT.get_template('index.html')
+
+# Fetch the details other instances have already computed in one batch, rather
+# than with one memcache RPC per polygon as they're requested.
+PrimePolygonDetailsCache()
 
 
 